@@ -506,6 +506,93 @@ class WRSNEnv(gym.Env):
             self.viewer = None
 
 
+class WRSNVecEnv():
+    """WRSNVecEnv.
+    Steps a batch of WRSNEnv in lockstep and stacks their observations
+    along the first dimension. Environments that already finished are not
+    stepped anymore, they keep returning their terminal state with zero reward.
+    """
+
+    def __init__(self, sensors, targets, wp=WrsnParameters, normalize=False, out=None):
+        """__init__.
+
+        Parameters
+        ----------
+        sensors : (num_envs, num_sensors, 2)
+            sensors
+        targets : (num_envs, num_targets, 2)
+            targets
+        out : tuple of 3 float32 ndarray, optional
+            persistent (mc_state, depot_state, sn_state) buffers which
+            observations are written into, allocated if not given
+        """
+        self.envs = [WRSNEnv(sensors=sn, targets=tg, wp=wp, normalize=normalize)
+                     for sn, tg in zip(sensors, targets)]
+        self.num_envs = len(self.envs)
+        self.action_space = self.envs[0].action_space
+        self.dones = np.zeros(self.num_envs, dtype=bool)
+
+        if out is None:
+            out = tuple(np.empty((self.num_envs, *space.shape), dtype=np.float32)
+                        for space in self.envs[0].observation_space.spaces)
+        self.mc_state, self.depot_state, self.sn_state = out
+
+    @property
+    def last_actions(self):
+        return np.array([env.last_action for env in self.envs], dtype=np.int64)
+
+    def reset(self):
+        self.dones[:] = False
+        for i, env in enumerate(self.envs):
+            self._write(i, env.reset())
+        return self.get_state()
+
+    def step(self, actions):
+        """step.
+
+        Parameters
+        ----------
+        actions : (num_envs,)
+            one action for each environment, ignored for finished ones
+
+        Returns:
+        ----------
+            observation: (mc_state, depot_state, sn_state) buffers, they are
+                         overwritten in place by the next step() or reset()
+            reward (num_envs, 2): (t, d) rewards of each environment
+            done (num_envs,): whether each environment has ended
+            info (list): info dict of each environment
+        """
+        rewards = np.zeros((self.num_envs, 2), dtype=np.float32)
+        infos = []
+
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            if self.dones[i]:
+                infos.append({})
+                continue
+
+            state, reward, done, info = env.step(int(action))
+            self._write(i, state)
+            rewards[i] = reward
+            self.dones[i] = done
+            infos.append(info)
+
+        return self.get_state(), rewards, self.dones.copy(), infos
+
+    def get_state(self):
+        return (self.mc_state, self.depot_state, self.sn_state)
+
+    def _write(self, i, state):
+        mc_state, depot_state, sn_state = state
+        self.mc_state[i] = mc_state
+        self.depot_state[i] = depot_state
+        self.sn_state[i] = sn_state
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+
+
 
 if __name__ == '__main__':
     np.set_printoptions(suppress=True)
@@ -1,6 +1,12 @@
 import random
 import argparse
+import contextlib
+import functools
 import os
+# caching allocator settings are only read at the first cuda allocation
+os.environ.setdefault('PYTORCH_CUDA_ALLOC_CONF', 
+                      'expandable_segments:True,max_split_size_mb:128,'
+                      'garbage_collection_threshold:0.8')
 import torch
 import time
 import numpy as np
@@ -8,13 +14,54 @@ from datetime import datetime
 
 import torch.nn.functional as F
 import torch.optim as optim
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel as DDP
 from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
 
 from model import MCActor, Critic
-from environment import WRSNEnv
+from environment import WRSNEnv, WRSNVecEnv
 from utils import NetworkInput, WRSNDataset, Point
 from utils import Config, DrlParameters as dp, WrsnParameters as wp
 from utils import logger, gen_cgrg, device, writer, make_logger, device_str
+from utils import discount_cumsum
+
+@functools.lru_cache(maxsize=None)
+def native_bf16():
+    """Whether the cuda device has native bf16 support (Ampere or newer).
+    Older gpus only emulate bf16, which is slower than fp32.
+    """
+    return device.type == 'cuda' and torch.cuda.get_device_capability()[0] >= 8
+
+def autocast():
+    """bf16 autocast context for network forwards, a no-op unless running on
+    a cuda device with native bf16 support and dp.use_amp is set. Weight cast
+    caching is disabled since it is not allowed with cuda graphs.
+    """
+    enabled = dp.use_amp and native_bf16()
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16,
+                          enabled=enabled, cache_enabled=False)
+
+def masked_log_softmax(logit, mask):
+    """Log-probabilities over the actions allowed by the bool mask.
+    Masked actions get the lowest finite logit instead of -inf, so that
+    their zero probability does not make the entropy nan.
+    """
+    logit = logit.masked_fill(~mask, torch.finfo(logit.dtype).min)
+    return F.log_softmax(logit, dim=-1)
+
+@contextlib.contextmanager
+def full_fp32():
+    """Disables the tf32 matmuls main() enables globally, within the block."""
+    matmul_tf32 = torch.backends.cuda.matmul.allow_tf32
+    cudnn_tf32 = torch.backends.cudnn.allow_tf32
+    torch.backends.cuda.matmul.allow_tf32 = False
+    torch.backends.cudnn.allow_tf32 = False
+    try:
+        yield
+    finally:
+        torch.backends.cuda.matmul.allow_tf32 = matmul_tf32
+        torch.backends.cudnn.allow_tf32 = cudnn_tf32
 
 def decision_maker(mc_state, depot_state, sn_state, mask, actor):
     actor.eval()
@@ -22,16 +69,68 @@ def decision_maker(mc_state, depot_state, sn_state, mask, actor):
     depot_state = depot_state.unsqueeze(0)
     sn_state = sn_state.unsqueeze(0)
 
-    with torch.no_grad():
+    # evaluation stays in full fp32 (no bf16 autocast, no tf32), so that
+    # reported metrics do not depend on use_amp or the gpu generation
+    with torch.no_grad(), full_fp32():
         logit = actor(mc_state, depot_state, sn_state)
 
-    logit = logit + mask.log()
-    prob = F.softmax(logit, dim=-1)
+    log_prob = masked_log_softmax(logit, mask)
 
-    prob, action = torch.max(prob, 1)  # Greedy selection
+    action = log_prob.argmax(1, keepdim=True)  # Greedy selection
+    prob = log_prob.gather(1, action).exp()
     actor.train()
     return action.squeeze().item(), prob
 
+def unwrap(model):
+    """Returns the original module of a compiled and/or DDP model (or the model itself)."""
+    model = getattr(model, '_orig_mod', model)
+    return getattr(model, 'module', model)
+
+def is_main_process():
+    """Whether this process logs and saves checkpoints (rank 0, or not distributed)."""
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+def reduce_sum(tensor):
+    """Sums tensor over all ranks in place (a no-op when not distributed)."""
+    if dist.is_initialized():
+        dist.all_reduce(tensor)
+    return tensor
+
+def to_device(stage):
+    """Copies a host staging buffer to device asynchronously.
+    The environment rewrites its staging buffers in place every step, so a new
+    tensor is always returned (even on cpu) instead of an alias of the buffer.
+    """
+    return stage.to(device=device, non_blocking=True, copy=True)
+
+def graph_forward(model, sample_args):
+    """Captures an inference forward of model on sample_args into a cuda graph.
+    The returned function replays the graph on arguments of the same shapes,
+    its output is overwritten by the next call. Parameters are captured by
+    address, so in-place optimizer updates are picked up by the replays.
+    """
+    static_args = tuple(arg.clone() for arg in sample_args)
+
+    # warm up on a side stream before capturing, as required by cuda graphs
+    stream = torch.cuda.Stream()
+    stream.wait_stream(torch.cuda.current_stream())
+    with torch.cuda.stream(stream), torch.inference_mode(), autocast():
+        for _ in range(3):
+            model(*static_args)
+    torch.cuda.current_stream().wait_stream(stream)
+
+    graph = torch.cuda.CUDAGraph()
+    with torch.cuda.graph(graph), torch.inference_mode(), autocast():
+        static_output = model(*static_args)
+
+    def forward(*args):
+        for static_arg, arg in zip(static_args, args):
+            static_arg.copy_(arg)
+        graph.replay()
+        return static_output
+
+    return forward
+
 def validate(data_loader, decision_maker, args=None, wp=wp,
              render=False, verbose=False, max_step=None, normalize=True,
              on_validation_begin=None, on_validation_end=None, 
@@ -73,7 +172,7 @@ def validate(data_loader, decision_maker, args=None, wp=wp,
         aggregated_ecrs = []
         node_failures = []
 
-        mask = torch.ones(env.action_space.n).to(device)
+        mask = torch.ones(env.action_space.n, dtype=torch.bool, device=device)
 
         max_step = max_step or dp.max_step
         for step in range(max_step):
@@ -85,10 +184,10 @@ def validate(data_loader, decision_maker, args=None, wp=wp,
             else:
                 action, prob = decision_maker(mc_state, depot_state, sn_state, mask)
             
-            mask[env.last_action] = 1.0
+            mask[env.last_action] = True
             (mc_state, depot_state, sn_state), reward, done, _ = env.step(action)
-            mask[env.last_action] = 0.0
-            # mask[0] = 1.0
+            mask[env.last_action] = False
+            # mask[0] = True
                 
             mc_state = torch.from_numpy(mc_state).to(dtype=torch.float32, device=device)
             depot_state = torch.from_numpy(depot_state).to(dtype=torch.float32, device=device)
@@ -149,169 +248,306 @@ def validate(data_loader, decision_maker, args=None, wp=wp,
     return ret
 
 
+def run_episodes(actor, critic, sensors, targets, stages, wp=wp, dp=dp, 
+                 sampler=None):
+    """Rolls out a batch of episodes and builds their A2C loss.
+
+    Actions are sampled under inference mode, the states, masks and actions
+    are recorded and both networks are then run once with grad over all the
+    transitions of the batch to build the loss. The actor keeps dropout in
+    both passes, with independent masks, so the policy gradient is slightly
+    off-policy with respect to the dropout noise that sampled the actions.
+
+    Parameters
+    ----------
+    sensors : (batch_size, num_sensors, 2)
+        sensors
+    targets : (batch_size, num_targets, 2)
+        targets
+    stages : tuple of 3 cpu tensors
+        (mc, depot, sn) host buffers of batch_size rows the envs write into
+    sampler : callable
+        actor forward used to sample actions (defaults to actor)
+
+    Returns:
+    ----------
+    loss : scalar tensor
+        policy loss + value_coef * value loss, averaged over episodes
+    stats : (4,) tensor
+        sums of (policy_loss, entropy, reward, num_transitions)
+    info : dict
+        mean steps, network lifetime, mc travel distance and aggregated ecr
+    """
+    sampler = actor if sampler is None else sampler
+    actor.train()
+    batch_size = len(sensors)
+
+    venv = WRSNVecEnv(sensors=sensors, 
+                      targets=targets,
+                      wp=wp, 
+                      normalize=True,
+                      out=tuple(stage.numpy() for stage in stages))
+    num_actions = venv.action_space.n
+
+    # (max_step, batch_size, *) rollout storage, state buffers have an extra
+    # row for the state after the last step. Steps after an env is done are
+    # padding and masked out by alives
+    mc_states = torch.empty(dp.max_step + 1, *stages[0].shape, device=device)
+    sn_states = torch.empty(dp.max_step + 1, *stages[2].shape, device=device)
+    masks = torch.empty(dp.max_step, batch_size, num_actions, 
+                        dtype=torch.bool, device=device)
+    actions = torch.empty(dp.max_step, batch_size, dtype=torch.long, device=device)
+    rewards = np.zeros((dp.max_step, batch_size), dtype=np.float32)
+    not_dones = np.zeros((dp.max_step, batch_size), dtype=np.float32)
+    alives = np.zeros((dp.max_step, batch_size), dtype=np.float32)
+    aggregated_ecrs = []
+
+    mask = torch.ones(batch_size, num_actions, dtype=torch.bool, device=device)
+    # device copy of the envs' last actions, (batch_size, 1) for scatter_
+    last_actions = torch.empty(batch_size, 1, dtype=torch.long, device=device)
+
+    venv.reset()
+    last_actions.copy_(torch.from_numpy(venv.last_actions).unsqueeze(1), non_blocking=True)
+    mc_states[0].copy_(stages[0], non_blocking=True)
+    # depot does not change during an episode
+    depot_state = to_device(stages[1])
+    sn_states[0].copy_(stages[2], non_blocking=True)
+
+    with torch.inference_mode():
+        for step in range(dp.max_step):
+            with autocast():
+                logit = sampler(mc_states[step], depot_state, sn_states[step])
+
+            log_prob = masked_log_softmax(logit.float(), mask)
+            action = torch.multinomial(log_prob.exp(), 1).squeeze(1)
+
+            masks[step] = mask
+            actions[step] = action
+
+            # envs which are still running before this step
+            alive = ~venv.dones
+
+            # action.cpu() synchronizes, so pending copies out of the
+            # staging buffers are done before the envs overwrite them
+            mask.scatter_(1, last_actions, True)
+            _, reward, done, info = venv.step(action.cpu().numpy())
+            last_actions.copy_(torch.from_numpy(venv.last_actions).unsqueeze(1), 
+                               non_blocking=True)
+            mask.scatter_(1, last_actions, False)
+            # mask[:, 0] = True # always allow MC staying at depot
+
+            mc_states[step + 1].copy_(stages[0], non_blocking=True)
+            sn_states[step + 1].copy_(stages[2], non_blocking=True)
+
+            rewards[step] = reward[:, 0] # using time only
+            not_dones[step] = ~done
+            alives[step] = alive
+            aggregated_ecrs.extend(env.net.aggregated_ecr 
+                                   for env, a in zip(venv.envs, alive) if a)
+
+            if done.all():
+                venv.close()
+                break
+
+        num_steps = step + 1
+
+        R = torch.zeros(batch_size, device=device)
+        if not done.all():
+            with autocast():
+                value = critic(mc_states[num_steps], depot_state, sn_states[num_steps])
+            R = value.squeeze(1).float()
+
+    rewards = rewards[:num_steps]
+    not_dones = not_dones[:num_steps]
+    alives = alives[:num_steps]
+
+    info = {}
+    info['steps'] = np.mean(alives.sum(0) - 1)
+    info['net_lifetime'] = np.mean([env.get_network_lifetime() for env in venv.envs])
+    info['mc_travel_dist'] = np.mean([env.get_travel_distance() for env in venv.envs])
+    info['aggregated_ecr'] = np.mean(aggregated_ecrs)
+
+    # training forward over the transitions of all envs at once
+    t_idx, b_idx = (torch.as_tensor(idx, device=device) for idx in np.nonzero(alives))
+    mc_input = mc_states[t_idx, b_idx]
+    depot_input = depot_state[b_idx]
+    sn_input = sn_states[t_idx, b_idx]
+
+    with autocast():
+        logit = actor(mc_input, depot_input, sn_input)
+        value = critic(mc_input, depot_input, sn_input)
+
+    # losses stay in fp32
+    log_prob = masked_log_softmax(logit.float(), masks[t_idx, b_idx])
+    entropies = -(log_prob.exp() * log_prob).sum(-1)
+    log_probs = log_prob.gather(1, actions[t_idx, b_idx].unsqueeze(1)).squeeze(1)
+    value = value.float().squeeze(1)
+
+    rewards = torch.as_tensor(rewards, device=device)
+    not_dones = torch.as_tensor(not_dones, device=device)
+    alives = torch.as_tensor(alives, device=device)
+
+    # Generalized Advantage Estimation and bootstrapped discounted returns,
+    # nothing is propagated across episode ends since padding steps have
+    # zero rewards and deltas
+    with torch.no_grad():
+        values = torch.zeros(num_steps + 1, batch_size, device=device)
+        values[t_idx, b_idx] = value.detach()
+        values[num_steps] = R
+
+        deltas = rewards + dp.gamma * values[1:] * not_dones - values[:-1]
+        advantages = discount_cumsum(deltas * alives, dp.gamma * dp.gae_lambda)
+
+        boot_rewards = rewards.clone()
+        boot_rewards[-1] += dp.gamma * values[-1] * not_dones[-1]
+        returns = discount_cumsum(boot_rewards, dp.gamma)
+
+    # summed over the steps of all envs
+    policy_loss = -(log_probs * advantages[t_idx, b_idx]).sum() - \
+        dp.entropy_coef * entropies.sum()
+    value_loss = 0.5 * F.mse_loss(value, returns[t_idx, b_idx], reduction='sum')
+
+    # advantages are detached, so the policy loss only reaches the actor
+    # and the value loss only the critic: a single backward serves both
+    loss = (policy_loss + dp.value_coef * value_loss) / batch_size
+
+    with torch.no_grad():
+        stats = torch.stack((policy_loss, 
+                             entropies.sum(), 
+                             (rewards * alives).sum(),
+                             alives.sum()))
+
+    return loss, stats, info
+
+
 def train(actor, critic, train_data, valid_data, save_dir, 
           epoch_start_idx=0, wp=wp, dp=dp):
     logger.info("Begin training phase")
-    train_loader = DataLoader(train_data, 1, True, num_workers=0)
+    pin_memory = device.type == 'cuda'
+    use_cuda_graph = dp.use_cuda_graph and not dp.use_compile and device.type == 'cuda'
+    # samples are generated up front by WRSNDataset, workers only index and collate
+    worker_kwargs = dict(persistent_workers=True, prefetch_factor=4) \
+        if dp.num_workers > 0 else {}
+    # each rank rolls out its own shard of the training data
+    train_sampler = DistributedSampler(train_data, shuffle=True) \
+        if dist.is_initialized() else None
+    num_samples = len(train_sampler) if train_sampler is not None else len(train_data)
+
+    # the sampling forward replays cuda graphs (reduce-overhead compile or a
+    # captured graph), which need a fixed shape: every batch has rollout_batch envs
+    fixed_batch = use_cuda_graph or dp.use_compile
+    if fixed_batch and num_samples < dp.rollout_batch:
+        # dropping the last batch would leave no batch at all
+        logger.warning("Only %d training samples per process, fewer than "
+                       "rollout_batch (%d): sampling without cuda graphs",
+                       num_samples, dp.rollout_batch)
+        use_cuda_graph = fixed_batch = False
+    train_loader = DataLoader(train_data, dp.rollout_batch, train_sampler is None, 
+                              sampler=train_sampler,
+                              num_workers=dp.num_workers, pin_memory=pin_memory, 
+                              drop_last=fixed_batch, **worker_kwargs)
     valid_loader = DataLoader(valid_data, 1, False, num_workers=0)
 
     actor_optim = optim.Adam(actor.parameters(), dp.actor_lr)
     critic_optim = optim.Adam(critic.parameters(), dp.critic_lr)
 
+    # persistent (pinned) host buffers the environments write observations into
+    mc_stage = torch.empty(dp.rollout_batch, dp.MC_INPUT_SIZE, pin_memory=pin_memory)
+    depot_stage = torch.empty(dp.rollout_batch, dp.DEPOT_INPUT_SIZE, pin_memory=pin_memory)
+    sn_stage = torch.empty(dp.rollout_batch, train_data.num_sensors, dp.SN_INPUT_SIZE,
+                           pin_memory=pin_memory)
+
+    sampler = None
+    if dp.use_compile and fixed_batch:
+        # actor & critic are compiled with dynamic shapes for the training
+        # forward, the sampling forward always sees a full rollout batch
+        sampler = torch.compile(unwrap(actor), mode='reduce-overhead')
+    elif use_cuda_graph:
+        # the sampling forward of the actor on a rollout batch is replayed from
+        # a graph, the training forward has a varying number of transitions
+        sample_args = tuple(torch.zeros_like(stage, device=device) 
+                            for stage in (mc_stage, depot_stage, sn_stage))
+        # captured with dropout, like the training forward in run_episodes
+        actor.train()
+        sampler = graph_forward(unwrap(actor), sample_args)
+
+    if device.type == 'cuda':
+        # run one batch of episodes and drop its gradients, so that the caching
+        # allocator already holds blocks of the sizes used by training
+        sensors, targets = next(iter(train_loader))
+        stages = tuple(stage[:len(sensors)] 
+                       for stage in (mc_stage, depot_stage, sn_stage))
+        loss, _, _ = run_episodes(actor, critic, sensors, targets, stages, wp, dp,
+                                  sampler)
+        loss.backward()
+        actor_optim.zero_grad(set_to_none=True)
+        critic_optim.zero_grad(set_to_none=True)
 
     best_params = None
     best_reward = np.inf
-    sample_inp = None
 
     for epoch in range(epoch_start_idx, dp.num_epoch):
         logger.info("Start epoch %d" % epoch)
-        actor.train()
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
         critic.train()
 
         epoch_start = time.time()
         start = epoch_start
 
-        mean_policy_losses = []
-        mean_entropies = []
+        # running sums of (policy_loss, entropy, reward, num_transitions), kept on
+        # device and only synchronized when logging
+        window_stats = torch.zeros(4, device=device)
+        epoch_stats = torch.zeros(4, device=device)
         mean_aggregated_ecrs = []
         times = [0]
         net_lifetimes = []
         mc_travel_dists = []
         steps = []
-        mean_rewards = []
 
         for idx, data in enumerate(train_loader):
             sensors, targets = data
+            stages = tuple(stage[:len(sensors)] 
+                           for stage in (mc_stage, depot_stage, sn_stage))
 
-            env = WRSNEnv(sensors=sensors.squeeze(), 
-                          targets=targets.squeeze(),
-                          wp=wp, 
-                          normalize=True)
-
-            mc_state, depot_state, sn_state = env.reset()
-            mc_state = torch.from_numpy(mc_state).to(dtype=torch.float32, device=device)
-            depot_state = torch.from_numpy(depot_state).to(dtype=torch.float32, device=device)
-            sn_state = torch.from_numpy(sn_state).to(dtype=torch.float32, device=device)
-
-            values = []
-            log_probs = []
-            rewards = []
-            entropies = []
-            aggregated_ecrs = []
-
-            mask = torch.ones(env.action_space.n).to(device)
-
-            for step in range(dp.max_step):
-                mc_state = mc_state.unsqueeze(0)
-                depot_state = depot_state.unsqueeze(0)
-                sn_state = sn_state.unsqueeze(0)
-                
-                if sample_inp is None:
-                    sample_inp = (mc_state, depot_state, sn_state)
-
-                logit = actor(mc_state, depot_state, sn_state)
-                logit = logit + mask.log()
-
-                prob = F.softmax(logit, dim=-1)
-
-                value = critic(mc_state, depot_state, sn_state)
-
-                m = torch.distributions.Categorical(prob)
-
-                # Sometimes an issue with Categorical & sampling on GPU; See:
-                # https://github.com/pemami4911/neural-combinatorial-rl-pytorch/issues/5
-                action = m.sample()
-                logp = m.log_prob(action)
-                entropy = m.entropy()
-
-                mask[env.last_action] = 1.0
-                (mc_state, depot_state, sn_state), reward, done, info = env.step(action.squeeze().item())
-                mask[env.last_action] = 0.0
-                # mask[0] = 1 # always allow MC staying at depot
+            loss, stats, info = run_episodes(actor, critic, sensors, targets, 
+                                             stages, wp, dp, sampler)
 
-                mc_state = torch.from_numpy(mc_state).to(dtype=torch.float32, device=device)
-                depot_state = torch.from_numpy(depot_state).to(dtype=torch.float32, device=device)
-                sn_state = torch.from_numpy(sn_state).to(dtype=torch.float32, device=device)
-
-                values.append(value) 
-                rewards.append(reward)
-                log_probs.append(logp)
-                entropies.append(entropy)
-                aggregated_ecrs.append(env.net.aggregated_ecr)
-
-                if done:
-                    env.close()
-                    break
-            steps.append(step)
-
-            R = torch.zeros(1, 1).to(device)
-            if not done:
-                value = critic(mc_state.unsqueeze(0), 
-                               depot_state.unsqueeze(0), 
-                               sn_state.unsqueeze(0))
-                R = value.detach() if value is not None else value
-
-            values.append(R)
-            
-            net_lifetimes.append(env.get_network_lifetime())
-            mc_travel_dists.append(env.get_travel_distance())
-            mean_aggregated_ecrs.append(np.mean(aggregated_ecrs))
-            
-            gae = torch.zeros(1, 1).to(device)
-            policy_losses = torch.zeros(len(rewards))
-            value_losses = torch.zeros(len(rewards))
-
-            R = values[-1]
-            
-            for i in reversed(range(len(rewards))):
-                reward = rewards[i][0] # using time only
-                R = dp.gamma * R + reward
-                advantage = R - values[i]
-
-                value_losses[i] = 0.5 * advantage.pow(2)
-
-                # Generalized Advantage Estimation
-                delta_t = reward + dp.gamma * \
-                    values[i + 1] - values[i]
-                gae = gae * dp.gamma * dp.gae_lambda + delta_t
-
-                policy_losses[i] = -log_probs[i] * gae.detach() - \
-                                     dp.entropy_coef * entropies[i]
-
-            actor_optim.zero_grad()
-            policy_losses.sum().backward()
+            actor_optim.zero_grad(set_to_none=True)
+            critic_optim.zero_grad(set_to_none=True)
+            loss.backward()
             torch.nn.utils.clip_grad_norm_(actor.parameters(), dp.max_grad_norm)
-            actor_optim.step()
-
-            critic_optim.zero_grad()
-            value_losses.sum().backward()
             torch.nn.utils.clip_grad_norm_(critic.parameters(), dp.max_grad_norm)
+            actor_optim.step()
             critic_optim.step()
 
-            with torch.no_grad():
-                pl = torch.mean(policy_losses).item()
-                mean_policy_losses.append(pl)
-                vl = torch.mean(value_losses).item()
-
-                e = torch.mean(torch.Tensor(entropies)).item()
-                mean_entropies.append(e)
-
-                r = np.mean([reward[0] for reward in rewards])
-                mean_rewards.append(r)
-
+            window_stats += stats
+            epoch_stats += stats
+            steps.append(info['steps'])
+            net_lifetimes.append(info['net_lifetime'])
+            mc_travel_dists.append(info['mc_travel_dist'])
+            mean_aggregated_ecrs.append(info['aggregated_ecr'])
 
             if (idx + 1) % dp.log_size == 0:
                 end = time.time()
                 times.append(end-start)
                 start = end
 
-                mm_policy_loss = np.mean(mean_policy_losses[-dp.log_size:])
-                mm_entropies = np.mean(mean_entropies[-dp.log_size:])
-                m_net_lifetime = np.mean(net_lifetimes[-dp.log_size:])
-                m_mc_travel_dist = np.mean(mc_travel_dists[-dp.log_size:])
-                mm_rewards = np.mean(mean_rewards[-dp.log_size:])
-                m_steps = np.mean(steps[-dp.log_size:])
-                mm_aggregated_ecr = np.mean(mean_aggregated_ecrs[-dp.log_size:])
+                # means of this rank's window, the trailing 1 counts the ranks
+                window_info = torch.tensor([np.mean(net_lifetimes[-dp.log_size:]),
+                                            np.mean(mc_travel_dists[-dp.log_size:]),
+                                            np.mean(steps[-dp.log_size:]),
+                                            np.mean(mean_aggregated_ecrs[-dp.log_size:]),
+                                            1.], dtype=window_stats.dtype, device=device)
+                window = reduce_sum(torch.cat((window_stats, window_info)))
+                window_stats.zero_()
+                mm_policy_loss, mm_entropies, mm_rewards = \
+                    (window[:3] / window[3]).tolist()
+                m_net_lifetime, m_mc_travel_dist, m_steps, mm_aggregated_ecr = \
+                    (window[4:8] / window[8]).tolist()
+
+                if not is_main_process():
+                    continue
 
                 global_step = (idx + epoch * len(train_loader)) / dp.log_size
                 writer.add_scalar('batch/policy_loss', mm_policy_loss, global_step)
@@ -330,11 +566,21 @@ def train(actor, critic, train_data, valid_data, save_dir,
                                    mm_rewards, m_steps, mm_aggregated_ecr,
                                    mm_entropies, times[-1]))
 
-        mm_policy_loss = np.mean(mean_policy_losses)
-        mm_entropies = np.mean(mean_entropies)
-        m_net_lifetime = np.mean(net_lifetimes)
-        m_mc_travel_dist = np.mean(mc_travel_dists)
+        epoch_info = torch.tensor([np.mean(net_lifetimes), np.mean(mc_travel_dists), 1.],
+                                  dtype=epoch_stats.dtype, device=device)
+        epoch_stats = reduce_sum(torch.cat((epoch_stats, epoch_info)))
+        mm_policy_loss, mm_entropies, _ = (epoch_stats[:3] / epoch_stats[3]).tolist()
+        m_net_lifetime, m_mc_travel_dist = (epoch_stats[4:6] / epoch_stats[6]).tolist()
+
+
+        # every rank validates the (identical) model, so that none of them
+        # waits on the others in the next gradient all-reduce
+        res = validate(valid_loader, decision_maker, (actor,), wp, max_step=dp.max_step)
+        m_net_lifetime_valid = res['lifetime_mean'] 
+        m_mc_travel_dist_valid = res['travel_dist_mean']
 
+        if not is_main_process():
+            continue
 
         # Save the weights
         epoch_dir = os.path.join(save_dir, '%s' % epoch)
@@ -342,17 +588,13 @@ def train(actor, critic, train_data, valid_data, save_dir,
             os.makedirs(epoch_dir)
 
         save_path = os.path.join(epoch_dir, 'actor.pt')
-        torch.save(actor.state_dict(), save_path)
+        torch.save(unwrap(actor).state_dict(), save_path)
 
         save_path = os.path.join(epoch_dir, 'critic.pt')
-        torch.save(critic.state_dict(), save_path)
-
-        res = validate(valid_loader, decision_maker, (actor,), wp, max_step=dp.max_step)
-        m_net_lifetime_valid = res['lifetime_mean'] 
-        m_mc_travel_dist_valid = res['travel_dist_mean']
+        torch.save(unwrap(critic).state_dict(), save_path)
 
         writer.add_scalar('epoch/policy_loss', mm_policy_loss, epoch)
-        writer.add_scalar('epoch/entropy', e, epoch)
+        writer.add_scalar('epoch/entropy', mm_entropies, epoch)
         writer.add_scalars('epoch/net_lifetime', 
                            {'train': m_net_lifetime,
                             'valid': m_net_lifetime_valid},
@@ -368,10 +610,10 @@ def train(actor, critic, train_data, valid_data, save_dir,
             best_reward = m_net_lifetime_valid
 
             save_path = os.path.join(save_dir, 'actor.pt')
-            torch.save(actor.state_dict(), save_path)
+            torch.save(unwrap(actor).state_dict(), save_path)
 
             save_path = os.path.join(save_dir, 'critic.pt')
-            torch.save(critic.state_dict(), save_path)
+            torch.save(unwrap(critic).state_dict(), save_path)
 
         msg = 'Epoch %d: mean_policy_losses: %2.3f, ' + \
             'mean_net_lifetime: %2.4f, mean_mc_travel_dist: %2.4f, ' + \
@@ -381,12 +623,21 @@ def train(actor, critic, train_data, valid_data, save_dir,
                            m_mc_travel_dist, mm_entropies, m_net_lifetime_valid,
                            time.time() - epoch_start, np.mean(times)))
 
-    writer.add_graph(actor, sample_inp)
+    if is_main_process():
+        sample_inp = tuple(to_device(stage) for stage in (mc_stage, depot_stage, sn_stage))
+        writer.add_graph(unwrap(actor), sample_inp)
 
 
 def main(num_sensors=20, num_targets=10, config=None,
          checkpoint=None, save_dir='checkpoints', seed=123, 
-         mode='train', epoch_start=0, render=False, verbose=False):
+         mode='train', epoch_start=0, render=False, verbose=False,
+         distributed=False):
+    if distributed:
+        # launched by torchrun, one process per gpu
+        local_rank = int(os.environ['LOCAL_RANK'])
+        torch.cuda.set_device(local_rank)
+        dist.init_process_group('nccl')
+
     logger.info("Running problem with %d sensors %d targets: " + 
                 "(checkpoint: %s, seed : %d, config: %s)", 
                 num_sensors, num_targets, checkpoint, seed, config or 'default')
@@ -401,6 +652,14 @@ def main(num_sensors=20, num_targets=10, config=None,
         basefile = 'default'
     save_dir = os.path.join(save_dir, basefile)
 
+    # tf32 for the matmuls not covered by bf16 autocast
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    torch.set_float32_matmul_precision('high')
+    # MCActor & Critic only use Linear/bmm, so cudnn has no kernels to tune for
+    # them: this only matters if convolution or rnn layers are added
+    torch.backends.cudnn.benchmark = True
+
     actor = MCActor(dp.MC_INPUT_SIZE,
                     dp.DEPOT_INPUT_SIZE, 
                     dp.SN_INPUT_SIZE,
@@ -419,6 +678,21 @@ def main(num_sensors=20, num_targets=10, config=None,
         path = os.path.join(checkpoint, 'critic.pt')
         critic.load_state_dict(torch.load(path, device))
 
+    if distributed:
+        # gradients are all-reduced across ranks once per update
+        actor = DDP(actor, device_ids=[local_rank])
+        critic = DDP(critic, device_ids=[local_rank])
+
+    if dp.use_compile:
+        # compile after loading the checkpoint, the compiled wrappers prefix their
+        # state_dict keys, so checkpoints are always saved from unwrap(model).
+        # Switching train/eval mode triggers a separate compiled graph.
+        # The training forward gets a different number of transitions on every
+        # update, so these are compiled for dynamic shapes (no cuda graphs),
+        # train() compiles a separate reduce-overhead sampler.
+        actor = torch.compile(actor, dynamic=True)
+        critic = torch.compile(critic, dynamic=True)
+
     if mode == 'train':
         logger.info("Generating training dataset")
         train_data = WRSNDataset(num_sensors, num_targets, dp.train_size, seed)
@@ -435,6 +709,9 @@ def main(num_sensors=20, num_targets=10, config=None,
     logger.info("Test metrics: Mean network lifetime %2.4f, mean travel distance: %2.4f",
                 lifetime, travel_dist)
 
+    if distributed:
+        dist.destroy_process_group()
+
 
 if __name__ == '__main__':
     
@@ -449,6 +726,8 @@ if __name__ == '__main__':
     parser.add_argument('--render', '-r', action='store_true')
     parser.add_argument('--verbose', '-v', action='store_true')
     parser.add_argument('--seed', '-s', default=123, type=int)
+    # launch with: torchrun --nproc_per_node=N main.py --distributed
+    parser.add_argument('--distributed', action='store_true')
 
     args = parser.parse_args()
 
@@ -459,7 +738,9 @@ if __name__ == '__main__':
     now = datetime.now()
     dt_str = now.strftime("%d_%m_%Y_%H_%M_%S")
     log_dir = "logs/{}_{}".format(basefile, dt_str)
-    logger, writer = make_logger(log_dir)
+    # torchrun sets RANK, only rank 0 writes the log dir
+    rank = int(os.environ.get('RANK', 0)) if args.distributed else 0
+    logger, writer = make_logger(log_dir, rank)
 
     logger.info("Running on device: %s", device_str)
     logger.info("Log dir: %s", log_dir)
@@ -467,6 +748,7 @@ if __name__ == '__main__':
     torch.set_printoptions(sci_mode=False)
     seed = 46
     torch.manual_seed(args.seed + 12)
+    torch.cuda.manual_seed_all(args.seed + 12)
     np.random.seed(args.seed + 11)
     np.set_printoptions(suppress=True)
 
@@ -1,11 +1,11 @@
 from __future__ import annotations
 
-from queue import PriorityQueue
-
 import numpy as np
 import enum
 import math
 
+from numba import njit
+
 from utils import WrsnParameters
 from utils import NetworkInput, Point, logger
 from utils import dist, transmission_energy, energy_consumption
@@ -91,6 +91,65 @@ class Sensor(Node):
         self.is_active = True
 
 
+@njit(cache=True)
+def _shortest_path_tree(adj, dists, active, num_sensors):
+    """Dijkstra from the base station (node 0) over active nodes.
+    Only sensors forward packets, nodes after num_sensors are targets.
+
+    Returns:
+    ----------
+    trace : (num_nodes,)
+        parent of each node on its shortest path, -1 if unreachable
+    """
+    num_nodes = adj.shape[0]
+    trace = np.full(num_nodes, -1, dtype=np.int64)
+    d = np.full(num_nodes, np.inf, dtype=np.float32)
+    done = np.zeros(num_nodes, dtype=np.bool_)
+    d[0] = 0.0
+
+    while True:
+        # unfinished node with the smallest distance, ties go to the smallest id
+        u = -1
+        du = np.float32(np.inf)
+        for v in range(num_nodes):
+            if not done[v] and d[v] < du:
+                u = v
+                du = d[v]
+        if u == -1:
+            break
+        done[u] = True
+
+        # BS and TG do not have forwarding function
+        if u > num_sensors or (u == 0 and du > 0):
+            continue
+
+        for v in range(num_nodes):
+            if not adj[u, v] or not active[v]:
+                continue
+            # float32 sum, as numpy does for a float32 distance plus a python float
+            duv = du + dists[u, v]
+            if d[v] > duv:
+                d[v] = duv
+                trace[v] = u
+                done[v] = False
+
+    return trace
+
+
+@njit(cache=True)
+def _forwarding_load(trace, no_targets, num_sensors):
+    """Number of packets each sensor forwards, given the routing tree."""
+    eta = np.zeros(num_sensors + 1)
+    for i in range(1, num_sensors + 1):
+        if no_targets[i] == 0:
+            continue
+        u = i
+        while u > 0 and trace[u] != -1:
+            u = trace[u]
+            eta[u] += 1
+    return eta
+
+
 class WRSNNetwork():
     """WRSNNetwork.
     """
@@ -122,6 +181,16 @@ class WRSNNetwork():
         self.edges = set()
 
         self.__build_adjacency()
+
+        # dense topology used by the compiled routing kernels
+        self.adj_matrix = np.zeros((self.num_nodes, self.num_nodes), dtype=bool)
+        self.dist_matrix = np.zeros((self.num_nodes, self.num_nodes), dtype=np.float32)
+        for node in self.nodes:
+            for other in node.adj:
+                self.adj_matrix[node.id, other.id] = True
+                self.dist_matrix[node.id, other.id] = dist(node.position, other.position)
+        self.no_targets = np.array([0, *(sn.no_targets for sn in self.sensors)])
+
         self.run_estimation()
 
     def __build_adjacency(self):
@@ -153,29 +222,9 @@ class WRSNNetwork():
     def __estimate_topology(self):
         """__dijkstra.
         """
-        trace = np.full(self.num_nodes, -1, dtype=int)
-        d = np.full(self.num_nodes, np.inf, dtype=np.float32)
-        d[0] = 0.0
-        q = PriorityQueue()
-        q.put((d[0], 0))
-
-        while not q.empty():
-            du, u = q.get()
-
-            # BS and TG do not have forwarding function
-            if d[u] != du or self.nodes[u].type is NodeType.TG \
-                    or (self.nodes[u].type is NodeType.BS and du > 0):
-                continue
-
-            for neighbor in self.nodes[u].adj:
-                if not neighbor.is_active:
-                    continue
-                v = neighbor.id
-                duv = du + dist(self.nodes[u].position, self.nodes[v].position)
-                if d[v] > duv:
-                    d[v] = duv
-                    trace[v] = u
-                    q.put((d[v], v))
+        active = np.array([node.is_active for node in self.nodes])
+        trace = _shortest_path_tree(self.adj_matrix, self.dist_matrix, 
+                                    active, self.num_sensors)
 
         # check if the network covers all targets or not
         if any(trace[self.num_sensors+1:] == -1):
@@ -187,15 +236,7 @@ class WRSNNetwork():
         """__estimate energy consumption rate.
         """
         # number of packets each sensor forwarding
-        eta = np.zeros(self.num_sensors + 1)
-
-        for i in range(1, self.num_sensors+1):
-            u = i
-            if self.nodes[u].no_targets == 0:
-                continue
-            while u > 0 and trace[u] != -1:
-                u = trace[u]
-                eta[u] += 1
+        eta = _forwarding_load(trace, self.no_targets, self.num_sensors)
 
         ecr = np.zeros(self.num_sensors + 1)
         for u in range(1, self.num_sensors + 1):
@@ -29,7 +29,7 @@ def random_decision_maker(mc_state, depot_state, sn_state, mask):
         if mc_state[2] - mc_state[4] * d_mc_i - \
             (sn_state[i, 2] - sn_state[i, 4] + sn_state[i, 5] * (t_mc_i + t_charge_i)) \
             - mc_state[4] * d_i_bs < 0:
-            mask_[i+1] = 0.0
+            mask_[i+1] = False
 
     return np.random.choice(np.nonzero(mask_.cpu().numpy())[0]), 0.0
 
@@ -5,8 +5,22 @@ from torch.utils.tensorboard import SummaryWriter
 logger = None
 writer = None
 
-def make_logger(log_dir):
+def make_logger(log_dir, rank=0):
     global logger, writer
+    if rank != 0:
+        # other ranks of a distributed run only report warnings and errors on
+        # stderr, they do not touch the log dir or create a writer
+        handler = logging.StreamHandler()
+        handler.addFilter(lambda record: record.levelno >= logging.WARNING)
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s [rank {}] [%(levelname)s] %(message)s".format(rank),
+            handlers=[handler]
+        )
+        logger = logging.getLogger()
+        writer = None
+        return logger, writer
+
     log_dir = log_dir or 'logs'
     os.makedirs(log_dir, exist_ok=True)
 
@@ -178,6 +178,10 @@ class DrlParameters(Config):
     test_size = 1000
     log_size = 100
     batch_size = 1
+    # number of environments rolled out in parallel per update
+    rollout_batch = 8
+    # number of data loading worker processes
+    num_workers = 4
     num_epoch = 20
     max_step = 1000
 
@@ -186,8 +190,17 @@ class DrlParameters(Config):
     max_grad_norm = 2.
     gae_lambda = 0.9
     entropy_coef = 0.01
+    value_coef = 1.0
     gamma = 0.9
 
+    # compile actor & critic with torch.compile
+    use_compile = False
+    # replay the actor forward used to sample actions from a cuda graph
+    # (cuda only, ignored when use_compile is set)
+    use_cuda_graph = False
+    # run actor & critic forward in bfloat16 autocast (cuda only)
+    use_amp = True
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Configuration')
@@ -31,3 +31,25 @@ def pload(name, outdir='.'):
     with open(os.path.join(outdir, name), mode='rb') as f:
         return pickle.load(f)
 
+
+def discount_cumsum(x, discount):
+    """discount_cumsum.
+    Reverse discounted cumulative sum over the first (time) dimension,
+    y[t] = sum_{k >= t} discount^(k - t) * x[k], computed as a single matmul
+    with the upper triangular matrix of discount powers. Unlike scaling a
+    cumsum by discount^-t, it does not underflow on long episodes and
+    handles discount = 0. Done in float64 so that tf32 matmul is not used.
+
+    Parameters
+    ----------
+    x : (num_steps, *)
+        sequence to be summed
+    discount : float
+        discount factor
+    """
+    num_steps = x.size(0)
+    steps = torch.arange(num_steps, device=x.device, dtype=torch.float64)
+    exponents = steps.unsqueeze(0) - steps.unsqueeze(1) # [t, k] = k - t
+    weights = torch.pow(discount, exponents.clamp(min=0)) * (exponents >= 0)
+    y = weights @ x.double().reshape(num_steps, -1)
+    return y.view_as(x).to(x.dtype)